@@ -176,6 +176,10 @@ except ImportError:
 
 import numpy
 # from . import toolbox # handled in functions that use it
+try:
+    import orjson # optional, faster parsing of JSON headers
+except ImportError:
+    orjson = None
 
 
 __contact__ = 'Steve Morley, smorley@lanl.gov'
@@ -187,6 +191,33 @@ except NameError:
     str_classes = (str, bytes)
     unicode = str
 
+#marks an attribute missing from the source of a new dmarray
+_NOATTR = object()
+
+#JSON-headed ASCII: the JSON object within the header
+_JSON_BODY = re.compile(r'\{\s*(.*)\s*\}', re.S)
+
+#types toHDF5 will write as attributes; numpy.generic covers numpy scalars
+try:
+    _ALLOWED_ATTR_TYPES = (int, long, float, numpy.ndarray, list, tuple,
+                           numpy.generic) + str_classes
+except NameError:
+    _ALLOWED_ATTR_TYPES = (int, float, numpy.ndarray, list, tuple,
+                           numpy.generic) + str_classes
+
+def _loads(js):
+    """Parse JSON text, with orjson if available
+
+    orjson is stricter than json (e.g. it rejects NaN), so anything it
+    fails on is handed to json.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(js)
+        except ValueError:
+            pass
+    return json.loads(js)
+
 class DMWarning(Warning):
     """
     Warnings class for datamodel, subclassed so it can be set to always
@@ -201,7 +232,8 @@ class MetaMixin(object):
     access to metadata via either an ``attrs`` attribute or ``meta``.
     This mixin class supports that recommendation.
     """
-    
+    __slots__ = () # leave instance layout to the classes using the mixin
+
     @property
     def meta(self):
         """Equivalent to ``attrs``
@@ -260,12 +292,20 @@ class dmarray(numpy.ndarray, MetaMixin):
     >>> name.tolist()
     'TestName'
 
+    An ndarray given as input is not copied, unless ``dtype`` is given,
+    in which case the data are always copied.
+
     .. currentmodule:: spacepy.datamodel
     .. autosummary::
         ~dmarray.addAttribute
     .. automethod:: addAttribute
     """
+    #attrs gets a slot; the instance dict is only made if other
+    #attributes are added (see Allowed_Attributes)
+    __slots__ = ('attrs', '__dict__')
     Allowed_Attributes = ['attrs']
+    #hashed copy of Allowed_Attributes for the __setattr__ check
+    _allowed = frozenset(Allowed_Attributes)
 
     def __new__(cls, input_array, attrs=None, dtype=None):
        # Input array is an already formed ndarray instance
@@ -273,12 +313,10 @@ class dmarray(numpy.ndarray, MetaMixin):
        if not dtype:
            obj = numpy.asarray(input_array).view(cls)
        else:
-           obj = numpy.asarray(input_array).view(cls).astype(dtype)
+           # always a copy (as astype was), but made in a single conversion
+           obj = numpy.array(input_array, dtype=dtype).view(cls)
        # add the new attribute to the created instance
-       if attrs != None:
-           obj.attrs = attrs
-       else:
-           obj.attrs = {}
+       obj.attrs = attrs if attrs is not None else {}
        # Finally, return the newly created object:
        return obj
 
@@ -286,8 +324,22 @@ class dmarray(numpy.ndarray, MetaMixin):
        # see InfoArray.__array_finalize__ for comments
         if obj is None:
             return
-        for val in self.Allowed_Attributes:
-            self.__setattr__(val, copy.deepcopy(getattr(obj, val, {})))
+        #this class's attributes, plus any added to the source array
+        #with addAttribute (which stores the list on the instance)
+        allowed = type(self).Allowed_Attributes
+        added = getattr(obj, '__dict__', {}).get('Allowed_Attributes')
+        if added is not None:
+            extra = [val for val in added if val not in allowed]
+            if extra:
+                allowed = allowed + extra
+                self.Allowed_Attributes = allowed
+        for val in allowed:
+            attr = getattr(obj, val, _NOATTR)
+            #missing or empty attrs just need a new empty dict, not a deepcopy
+            if attr is _NOATTR or (type(attr) is dict and not attr):
+                self.__setattr__(val, {})
+            else:
+                self.__setattr__(val, copy.deepcopy(attr))
 
     def __array_wrap__(self, out_arr, context=None):
         #check for zero-dims (numpy bug means subclass behaviour isn't consistent with ndarray
@@ -301,22 +353,54 @@ class dmarray(numpy.ndarray, MetaMixin):
         """This is called when pickling, see:
         http://www.mail-archive.com/numpy-discussion@scipy.org/msg02446.html
         for this particular example.
-        Only the attributes in Allowed_Attributes can exist
+        The state is the ndarray state plus a dict of attrs and anything
+        else added via Allowed_Attributes
         """
         object_state = list(numpy.ndarray.__reduce__(self))
-        subclass_state = tuple([tuple([val, self.__getattribute__(val)]) for val in self.Allowed_Attributes])
-        object_state[2] = (object_state[2],subclass_state)
+        object_state[2] = (object_state[2], self._ownstate())
         return tuple(object_state)
 
+    def _ownstate(self):
+        """dict of attrs (a slot) and the contents of the instance dict"""
+        own_state = self.__dict__.copy()
+        try:
+            own_state['attrs'] = self.attrs
+        except AttributeError: # attrs was deleted
+            pass
+        return own_state
+
+    def __reduce_ex__(self, protocol):
+        """Pickle with out-of-band data buffers for protocol 5 and up
+
+        numpy only uses pickle buffers for plain ndarrays, so reduce a
+        base-class view and rebuild the dmarray around it on unpickling.
+        Falls back to :meth:`__reduce__` where numpy does.
+        """
+        if protocol >= 5:
+            rv = numpy.ndarray.__reduce_ex__(
+                self.view(numpy.ndarray), protocol)
+            if len(rv) == 2: # buffer-based, no ndarray state
+                return (_rebuild_dmarray, (type(self),) + rv,
+                        (None, self._ownstate()))
+        return self.__reduce__()
+
     def __setstate__(self, state):
         """Used for unpickling after __reduce__ the self.attrs is recovered from
         the way it was saved and reset.
         """
         nd_state, own_state = state
-        numpy.ndarray.__setstate__(self,nd_state)
+        if nd_state is not None:
+            numpy.ndarray.__setstate__(self, nd_state)
+        if isinstance(own_state, dict):
+            own_state = own_state.copy()
+            if 'attrs' in own_state:
+                self.attrs = own_state.pop('attrs')
+            self.__dict__.update(own_state)
+            return
+        # pickles from older versions carry (name, value) pairs
         for i, val in enumerate(own_state):
             if not val[0] in self.Allowed_Attributes: # this is attrs
-                self.Allowed_Attributes.append(own_state[i][0])
+                self.Allowed_Attributes = self.Allowed_Attributes + [val[0]]
             self.__setattr__(own_state[i][0], own_state[i][1])
 
     def __setattr__(self, name, value):
@@ -325,11 +409,19 @@ class dmarray(numpy.ndarray, MetaMixin):
         dmarray_eq took 15.665865 s
         dmarray_assert took 16.025478 s
         It looks like != is the fastest, but not by much over 10000000 __setattr__
+
+        Membership is tested against the frozenset _allowed, which is kept
+        in step with Allowed_Attributes; the list itself is only searched
+        before raising, in case it was changed in place.
         """
+        if name == 'attrs': #by far the most common
+            pass
+        elif name == 'Allowed_Attributes':
+            super(dmarray, self).__setattr__('_allowed', frozenset(value))
         #meta is special-handled because it should NOT be pickled
-        if name in ('Allowed_Attributes', 'meta'):
+        elif name == 'meta':
             pass
-        elif not name in self.Allowed_Attributes:
+        elif not name in self._allowed and not name in self.Allowed_Attributes:
             raise(TypeError("Only attribute listed in Allowed_Attributes can be set"))
         super(dmarray, self).__setattr__(name, value)
 
@@ -338,10 +430,13 @@ class dmarray(numpy.ndarray, MetaMixin):
         equivalent to
         a = datamodel.dmarray([1,2,3])
         a.Allowed_Attributes = a.Allowed_Attributes + ['blabla']
+
+        The attribute is only added to this dmarray (and arrays derived
+        from it), not to every dmarray.
         """
         if name in self.Allowed_Attributes:
             raise(NameError('{0} is already an attribute cannot add again'.format(name)))
-        self.Allowed_Attributes.append(name)
+        self.Allowed_Attributes = self.Allowed_Attributes + [name]
         self.__setattr__(name, value)
 
     def count(self, srchval):
@@ -414,6 +509,15 @@ class dmarray(numpy.ndarray, MetaMixin):
         outarr = dmarray(numpy.concatenate( (one, other) , axis=axis ))
         return cls._replaceAttrs(outarr, backup)
 
+
+def _rebuild_dmarray(cls, func, args):
+    """Unpickle helper for dmarray, see :meth:`dmarray.__reduce_ex__`
+
+    Calls the ndarray reconstructor ``func`` with ``args`` and views the
+    result as ``cls``; attributes are restored by ``__setstate__``.
+    """
+    return func(*args).view(cls)
+
 def dmfilled(shape, fillval=0, dtype=None, order='C', attrs=None):
     """
     Return a new dmarray of given shape and type, filled with a specified value (default=0).
@@ -463,11 +567,13 @@ class SpaceData(dict, MetaMixin):
         ~SpaceData.toCDF
         ~SpaceData.toHDF5
         ~SpaceData.toJSONheadedASCII
+        ~SpaceData.toTable
     .. automethod:: flatten
     .. automethod:: tree
     .. automethod:: toCDF
     .. automethod:: toHDF5
     .. automethod:: toJSONheadedASCII
+    .. automethod:: toTable
     """
     def __getitem__(self, key):
         """
@@ -607,38 +713,146 @@ class SpaceData(dict, MetaMixin):
 
         '''
         flatobj = flatten(self)
-        remkeys = [key for key in self]
-        for key in remkeys:
-            del self[key]
-        for key in flatobj:
-            self[key] = copy.copy(flatobj[key])
+        self.clear()
+        self.update(flatobj)
+
+    def toTable(self, length=None):
+        '''
+        Copy all variables of a common length into one structured array
+
+        Each array variable whose first dimension matches is stored as a
+        field of a contiguous numpy structured array with one record per
+        element of that dimension, keeping any further dimensions as
+        subarrays. This allows operations across variables (e.g. masking
+        or sorting all of them by one) to be done in a single numpy call.
+        Other variables, nested SpaceData and all attributes are left out.
+        :func:`fromRecArray` converts the result back to a SpaceData.
+
+        Other Parameters
+        ----------------
+        length : int (optional)
+            length of the variables to include (default is the most common
+            length, the largest if there is a tie)
+
+        Returns
+        -------
+        out : numpy.ndarray
+            structured array with one field per variable, named by the
+            variable's key converted to str
+
+        Raises
+        ------
+        ValueError
+            if no variables have the requested length, or if two included
+            keys are the same once converted to str (e.g. ``5`` and ``'5'``)
+
+        Examples
+        --------
+        >>> import spacepy.datamodel as dm
+        >>> a = dm.SpaceData()
+        >>> a['x'] = dm.dmarray([1.0, 2.0, 3.0])
+        >>> a['y'] = dm.dmarray([[1, 2], [3, 4], [5, 6]])
+        >>> a['z'] = dm.dmarray([7, 8])
+        >>> tab = a.toTable()
+        >>> tab.dtype
+        dtype([('x', '<f8'), ('y', '<i8', (2,))])
+        >>> tab[tab['x'] > 1.5]['y']
+        array([[3, 4],
+               [5, 6]])
+        >>> dm.fromRecArray(tab).tree()
+        +
+        |____x
+        |____y
+        '''
+        lengths = [len(v) for v in self.values()
+                   if isinstance(v, numpy.ndarray) and v.ndim]
+        if length is None and lengths:
+            length = max(set(lengths), key=lambda n: (lengths.count(n), n))
+        if length not in lengths:
+            raise ValueError('No array variables of length {0}'.format(length))
+        keys = [k for k, v in self.items()
+                if isinstance(v, numpy.ndarray) and v.ndim and len(v) == length]
+        names = {}
+        for k in keys:
+            names.setdefault(str(k), []).append(k)
+        clashes = [v for v in names.values() if len(v) > 1]
+        if clashes:
+            raise ValueError('Keys are not unique as field names: {0}'.format(
+                ', '.join(' and '.join(repr(k) for k in v) for v in clashes)))
+        out = numpy.empty(length, dtype=[(str(k), self[k].dtype, self[k].shape[1:])
+                                         for k in keys])
+        for k in keys:
+            out[str(k)] = self[k]
+        return out
 
-            
 
 def convertKeysToStr(SDobject):
+    '''Convert all keys of a (nested) datamodel to strings
+
+    Parameters
+    ----------
+    SDobject : dict-like
+        datamodel (or other nested dict-like) to convert
+
+    Returns
+    -------
+    out : dict-like
+        object with all keys, including those of nested dict-likes,
+        converted to str. If all keys are already strings, this is
+        ``SDobject`` itself; otherwise new containers are made only where
+        needed, holding the same values (and attrs).
+    '''
+    #one pass over the items; arrays (the bulk of a datamodel) are
+    #rejected before the dict check
+    changed = False
+    items = []
+    for key, value in SDobject.items():
+        if not isinstance(value, numpy.ndarray) and isinstance(value, dict):
+            newvalue = convertKeysToStr(value) #unchanged if no conversion
+            changed = changed or newvalue is not value
+            value = newvalue
+        if not isinstance(key, str_classes):
+            key = str(key)
+            changed = True
+        items.append((key, value))
+    if not changed:
+        return SDobject
     if isinstance(SDobject, SpaceData):
         newSDobject = SpaceData()
         newSDobject.attrs = SDobject.attrs
     else:
         newSDobject = {}
-    for key in SDobject:
-        if not isinstance(key, str_classes):
-            if isinstance(SDobject[key], dict):
-                newSDobject[str(key)] = convertKeysToStr(SDobject[key])
-            else:
-                newSDobject[str(key)] = SDobject[key]
-        else:
-            if isinstance(SDobject[key], dict):
-                newSDobject[key] = convertKeysToStr(SDobject[key])
-            else:
-                newSDobject[key] = SDobject[key]
+    for key, value in items:
+        newSDobject[key] = value
 
     return newSDobject
 
 
-def flatten(dobj):
+def flatten(dobj, deepcopy=False, copy=False):
     '''Collapse datamodel to one level deep
 
+    Parameters
+    ----------
+    dobj : dict-like
+        datamodel (or other nested dict-like) to flatten
+
+    Other Parameters
+    ----------------
+    deepcopy : bool (optional)
+        return copies (see :func:`dmcopy`) of the values rather than the
+        values themselves, which are otherwise returned by reference
+        (default False)
+    copy : bool (optional)
+        return shallow copies (see :func:`copy.copy`) of the values rather
+        than the values themselves; ignored if ``deepcopy`` is set
+        (default False)
+
+    Returns
+    -------
+    out : dict-like
+        single-level object of the same type as ``dobj``, nested keys are
+        joined with ``'<--'``
+
     Examples
     --------
 
@@ -690,20 +904,25 @@ def flatten(dobj):
         addme = dobj.__class__()
     except (TypeError):
         addme = SpaceData()
-    remlist = []
-    for key in dobj: #iterate over keys in SpaceData
-        if isinstance(dobj[key], dict):
-            remlist.append(key)
-            newname = str(key) + '<--'
-            for levkey in dobj[key]:
-                if hasattr(dobj[key][levkey], 'keys'):
-                    retdict = flatten(dobj[key][levkey])
-                    for key2 in retdict:
-                        addme[newname+levkey+'<--'+key2] = retdict[key2]
-                else:
-                    addme[newname+levkey] = copy.copy(dobj[key][levkey])
+    # walk the tree with an explicit stack of (key path, value) pairs,
+    # children are pushed in reverse so the output keeps the input order
+    stack = [((key,), val) for key, val in reversed(list(dobj.items()))]
+    if copy:
+        from copy import copy as shallowcopy # the module name is shadowed
+    while stack:
+        keypath, val = stack.pop()
+        if isinstance(val, dict):
+            stack.extend((keypath + (key,), subval)
+                         for key, subval in reversed(list(val.items())))
+            continue
+        if deepcopy:
+            val = dmcopy(val)
+        elif copy:
+            val = shallowcopy(val)
+        if len(keypath) == 1: # top level keys are kept as-is
+            addme[keypath[0]] = val
         else:
-            addme[key] = copy.copy(dobj[key])
+            addme['<--'.join(str(key) for key in keypath)] = val
     return addme
 
 def unflatten(dobj, marker='<--'):
@@ -941,6 +1160,37 @@ def toCDF(fname, SDobject, **kwargs):
     return None
 
 
+def _copy_attrs(src, path=''):
+    """
+    Read all attributes from an attribute mapping (e.g. h5py ``attrs``)
+
+    All attributes are read in one pass; only if that fails are they read
+    one at a time, skipping (with a warning) those of unsupported datatype.
+
+    Parameters
+    ----------
+    src : dict-like
+        attributes to read
+    path : str (optional)
+        name of the object holding the attributes, for warnings
+
+    Returns
+    -------
+    out : dict
+        attribute names and values
+    """
+    try:
+        return dict(src.items())
+    except TypeError:
+        pass
+    out = {}
+    for key in src:
+        try:
+            out[key] = src[key]
+        except TypeError:
+            warnings.warn('Unsupported datatype in dataset {0}.attrs[{1}]'.format(path,key))
+    return out
+
 def fromHDF5(fname, **kwargs):
     '''
     Create a SpacePy datamodel representation of an HDF5 file or netCDF4 file which is HDF5 compliant
@@ -950,6 +1200,23 @@ def fromHDF5(fname, **kwargs):
     file : string
         the name of the HDF5/netCDF4 file to be loaded into a datamodel
 
+    Other Parameters
+    ----------------
+    path : str (optional)
+        group in the file to load (default '/')
+    rdcc_nbytes : int (optional)
+        size in bytes of the raw data chunk cache for each dataset, only
+        used if the file is given by name. Requires h5py 2.9 or later.
+        (default: HDF5 default, 1 MiB)
+    rdcc_nslots : int (optional)
+        number of slots in the chunk cache hash table, ideally a prime
+        about 100 times the number of chunks that fit in the cache, only
+        used if the file is given by name. Requires h5py 2.9 or later.
+        (default: HDF5 default, 521)
+    lazy : bool (optional)
+        memory-map datasets from the file instead of reading them, where
+        possible (default False). See notes.
+
     Returns
     -------
     out : spacepy.datamodel.SpaceData
@@ -969,60 +1236,88 @@ def fromHDF5(fname, **kwargs):
     netCDF4 (not netCDF3) and MatLab save files from v7.3 or later, but some
     datatypes are not supported, e.g., non-string vlen datatypes, and will
     raise a warning.
-    '''
-    def hdfcarryattrs(SDobject, hfile, path):
-        if hasattr(hfile[path],'attrs'):
-            #for key, value in hfile[path].attrs.iteritems():
-            for key in hfile[path].attrs:
-                try:
-                    value = hfile[path].attrs[key]
-                except TypeError:
-                    warnings.warn('Unsupported datatype in dataset {0}.attrs[{1}]'.format(path,key))
-                    continue
-                try:
-                    SDobject.attrs[key] = value
-                except:
-                    warnings.warn('The following key:value pair is not permitted\n' +
-                                    'key = {0} ({1})\n'.format(key, type(key)) +
-                                    'value = {0} ({1})'.format(value, type(value)), DMWarning)
 
+    All links (hard, soft and external) are followed, except a link to a
+    group that contains it, which would never end; these raise a warning.
+
+    With ``lazy``, a dataset stored contiguously (i.e. not chunked or
+    compressed) in a file opened with the default driver is returned as a
+    copy-on-write memory map of the file, so data are only read from disk
+    as they are used. Changes to the array are not written to the file.
+    All other datasets are read as usual.
+    '''
     try:
         import h5py as hdf
     except ImportError:
         raise ImportError('HDF5 converter requires h5py')
 
     if type(fname) in str_classes:
-        hfile = hdf.File(fname, mode='r')
+        #chunk cache options are only passed if given, older h5py lacks them
+        cache_opts = dict((key, kwargs[key]) for key in ('rdcc_nbytes', 'rdcc_nslots')
+                          if key in kwargs)
+        hfile = hdf.File(fname, mode='r', **cache_opts)
+        must_close = True
     else:
         hfile = fname
         #should test here for HDF file object
+        must_close = False
 
     if 'path' not in kwargs:
         path = '/'
     else:
         path = kwargs['path']
 
-    SDobject = SpaceData()
-    allowed_elems = [hdf.Group, hdf.Dataset]
-    ##carry over the attributes
-    hdfcarryattrs(SDobject, hfile, path)
-    ##carry over the groups and datasets
-    for key, value in hfile[path].items():
-        #try:
-            if type(value) is allowed_elems[0]: #if a group
-                SDobject[key] = SpaceData()
-                SDobject[key] = fromHDF5(hfile, path=path+'/'+key)
-            elif type(value) is allowed_elems[1]: #if a dataset
-                try:
-                    SDobject[key] = dmarray(value)
-                except (TypeError, ZeroDivisionError): #ZeroDivisionError catches zero-sized DataSets
-                    SDobject[key] = dmarray(None)
-                hdfcarryattrs(SDobject[key], hfile, path+'/'+key)
-        #except:
-        #    raise ValueError('HDF5 file contains type other than Group or Dataset')
-    if path=='/': hfile.close()
+    #memory mapping needs the raw file, with data at the reported offsets
+    lazy = kwargs.get('lazy', False) and hfile.driver == 'sec2' \
+           and hfile.userblock_size == 0
+
+    try:
+        root = hfile[path]
+        ##carry over the attributes
+        SDobject = SpaceData(attrs=_copy_attrs(root.attrs, path))
+        ##walk the tree with an explicit stack of (group, SpaceData, ids of
+        ##the groups on the path to it); items() follows every link (soft,
+        ##external, and each hard link), so links back up the path are cut
+        stack = [(root, SDobject, frozenset((root.id,)))]
+        while stack:
+            group, SDgroup, onpath = stack.pop()
+            for key, value in group.items():
+                if isinstance(value, hdf.Group):
+                    if value.id in onpath:
+                        warnings.warn('{0}/{1} links to a group containing it, '
+                                      'not followed'.format(group.name.rstrip('/'), key),
+                                      DMWarning)
+                        continue
+                    SDgroup[key] = SpaceData(attrs=_copy_attrs(value.attrs, value.name))
+                    stack.append((value, SDgroup[key], onpath | set((value.id,))))
+                elif isinstance(value, hdf.Dataset):
+                    try:
+                        if value.shape is None: #null dataspace
+                            data = dmarray(None)
+                        elif value.shape == () and value.dtype.kind == 'O':
+                            #scalar vlen (string): keep object dtype, value[()]
+                            #would give a bytes object and so a fixed-width array
+                            data = dmarray(numpy.asarray(value))
+                        elif lazy and _mmappable(value):
+                            data = dmarray(numpy.memmap(
+                                hfile.filename, mode='c', dtype=value.dtype,
+                                shape=value.shape, offset=value.id.get_offset()))
+                        else:
+                            data = dmarray(value[()])
+                    except (TypeError, ZeroDivisionError): #ZeroDivisionError catches zero-sized DataSets
+                        data = dmarray(None)
+                    data.attrs = _copy_attrs(value.attrs, value.name)
+                    SDgroup[key] = data
+    finally:
+        if must_close:
+            hfile.close()
     return SDobject
 
+def _mmappable(dset):
+    """True if an h5py Dataset is stored as a plain block in the file"""
+    return dset.chunks is None and dset.size > 0 \
+        and dset.dtype.kind in 'biufcS' and dset.id.get_offset() is not None
+
 def toHDF5(fname, SDobject, **kwargs):
     '''
     Create an HDF5 file from a SpacePy datamodel representation
@@ -1042,36 +1337,56 @@ def toHDF5(fname, SDobject, **kwargs):
     mode : str (optional)
         HDF5 file open mode (a, w, r) (default 'a')
     compression : str (optional)
-        compress all the variables using this method (default None) (gzip, shuffle, fletcher32, szip, lzf)
+        compress all the variables using this method (default 'gzip') (gzip, shuffle, fletcher32, szip, lzf),
+        None for no compression. Compressed variables are chunked and use the shuffle filter;
+        variables with fewer than 1024 elements are not compressed.
     compression_opts : str (optional)
-        options to the compression, see h5py documentation for more details
+        options to the compression, see h5py documentation for more details (default 4 for gzip)
+    page_size : int (optional)
+        if given, create the file with paged file space management using
+        pages of this size in bytes, and enable the page buffer. Requires
+        HDF5 1.10.1 or later and a version of h5py supporting paged
+        aggregation. Note that even small files will take at least a few
+        pages. (default None, no paging)
+    page_buf : int (optional)
+        size in bytes of the page buffer when ``page_size`` is given
+        (default 16 MiB)
 
     Returns
     -------
     None
 
+    Notes
+    -----
+    Variables are written one at a time. h5py holds a global lock around
+    every call into the HDF5 library (including compression, which happens
+    inside HDF5), so writing from several threads gives no overlap.
+
     Examples
     --------
     >>> import spacepy.datamodel as dm
     >>> a = dm.SpaceData()
     >>> a['data'] = dm.dmarray(range(100000), dtype=float)
     >>> dm.toHDF5('test_gzip.h5', a, overwrite=True, compression='gzip')
-    >>> dm.toHDF5('test.h5', a, overwrite=True)
+    >>> dm.toHDF5('test.h5', a, overwrite=True, compression=None)
     >>> # test_gzip.h5 was 118k, test.h5 was 785k
     '''
-    def SDcarryattrs(SDobject, hfile, path, allowed_attrs):
+    def SDcarryattrs(SDobject, hfile, path):
         if hasattr(SDobject, 'attrs'):
+            h5attrs = hfile[path].attrs
             for key, value in SDobject.attrs.items():
                 dumval, dumkey = copy.copy(value), copy.copy(key)
-                if type(value) in allowed_attrs:
-                    #test for datetimes in iterables
-                    if hasattr(value, '__iter__') and not isinstance(value, str_classes):
+                if isinstance(value, _ALLOWED_ATTR_TYPES):
+                    #test for datetimes in iterables (0-d arrays can't be iterated)
+                    if hasattr(value, '__iter__') and not isinstance(value, str_classes) \
+                       and getattr(value, 'ndim', 1):
                         dumval = [b.isoformat() if isinstance(b, datetime.datetime) else b for b in value]
                     truth = False
                     try:
                         if value.nbytes: truth = True #empty arrays of any dimension are nbytes=0
                     except AttributeError: #not an array
-                        if value or value == 0: truth = True
+                        if not (hasattr(value, '__len__') and len(value) == 0):
+                            truth = True
 
                     if truth:
                         if bytes is str:
@@ -1087,12 +1402,12 @@ def toHDF5(fname, SDobject, **kwargs):
                         try:
                             if uni:
                                 #Tell hdf5 this is unicode. Numpy is UCS-4, HDF5 is UTF-8
-                                hfile[path].attrs.create(dumkey, dumval,
+                                h5attrs.create(dumkey, dumval,
                                     dtype=hdf.special_dtype(vlen=unicode))
                             else:
-                                hfile[path].attrs[dumkey] = dumval
+                                h5attrs[dumkey] = dumval
                         except TypeError:
-                            hfile[path].attrs[dumkey] = str(dumval)
+                            h5attrs[dumkey] = str(dumval)
                             warnings.warn(
                                 'The following value is not permitted\n' +
                                 'key, value, type = {0}, {1}, {2})\n'.format(
@@ -1100,12 +1415,12 @@ def toHDF5(fname, SDobject, **kwargs):
                                 'value has been converted to a string for output',
                                 DMWarning)
                     else:
-                        hfile[path].attrs[dumkey] = ''
+                        h5attrs[dumkey] = ''
                 elif isinstance(value, datetime.datetime):
                     dumval = value.isoformat()
                     if bytes is str and type(key) is unicode:
                         dumkey = str(key)
-                    hfile[path].attrs[dumkey] = dumval
+                    h5attrs[dumkey] = dumval
                 else:
                     #TODO: add support for arrays(?) in attrs (convert to isoformat)
                     warnings.warn('The following key:value pair is not permitted\n' +
@@ -1128,23 +1443,42 @@ def toHDF5(fname, SDobject, **kwargs):
     else:
         wr_mo = kwargs['mode']
     if 'compression' not in kwargs:
-        h5_compr_type = None
+        h5_compr_type = 'gzip'
     else:
         h5_compr_type = kwargs['compression']
         if h5_compr_type not in ['gzip', 'szip', 'lzf', 'shuffle', 'fletcher32', None]:
             raise NotImplementedError('Specified compression type not supported')
-    if ('compression_opts' not in kwargs) or (h5_compr_type == 'lzf'):
+    if h5_compr_type == 'lzf':
         h5_compr_opts = None
+    elif 'compression_opts' not in kwargs:
+        h5_compr_opts = 4 if h5_compr_type == 'gzip' else None
     else:
         h5_compr_opts = kwargs['compression_opts']
 
+    def dset_opts(value):
+        """create_dataset keywords for storage of a variable"""
+        #filters need chunked storage; small or scalar data aren't worth it
+        if h5_compr_type is None or value.size < 1024:
+            return {}
+        return {'chunks': True, 'shuffle': True,
+                'compression': h5_compr_type,
+                'compression_opts': h5_compr_opts}
+
     if 'overwrite' not in kwargs: kwargs['overwrite'] = True
     if type(fname) in str_classes:
         if os.path.isfile(fname) and not kwargs['overwrite']:
             raise(IOError('Cannot write HDF5, file exists (see overwrite) "{0!s}"'.format(fname)))
         if os.path.isfile(fname) and kwargs['overwrite']:
             os.remove(fname)
-        hfile = hdf.File(fname, mode=wr_mo)
+        if kwargs.get('page_size'):
+            #file space strategy can only be set on create; any existing
+            #file has been removed already, so 'a' is the same as 'w'
+            hfile = hdf.File(fname, mode='w' if wr_mo == 'a' else wr_mo,
+                             fs_strategy='page',
+                             fs_page_size=kwargs['page_size'],
+                             page_buf_size=kwargs.get('page_buf', 16 * 1024**2))
+        else:
+            hfile = hdf.File(fname, mode=wr_mo)
         must_close = True
     else:
         hfile = fname
@@ -1155,39 +1489,29 @@ def toHDF5(fname, SDobject, **kwargs):
     else:
         path = '/'
 
-    # long is a type in python2 not in python3
-    # unicode is a type in python2 not in python3
-    try:
-        allowed_attrs = [int, long, float, str, unicode, numpy.ndarray, list, tuple, numpy.string_]
-    except NameError:
-        allowed_attrs = [int,       float, bytes, str, numpy.ndarray, list, tuple, numpy.string_]
-    for v in numpy.typecodes['AllInteger']:
-        allowed_attrs.append(numpy.typeDict[v])
-    for v in numpy.typecodes['AllFloat']:
-        allowed_attrs.append(numpy.typeDict[v])
-
-    allowed_elems = [SpaceData, dmarray]
 
     #first convert non-string keys to str
     SDobject = convertKeysToStr(SDobject)
-    SDcarryattrs(SDobject,hfile,path,allowed_attrs)
+    SDcarryattrs(SDobject,hfile,path)
 
     try:
+        grp = hfile[path] #look up the group once, not once per variable
         for key, value in SDobject.items():
-            if isinstance(value, allowed_elems[0]):
-                hfile[path].create_group(key)
+            if isinstance(value, SpaceData):
+                grp.create_group(key)
                 toHDF5(hfile, SDobject[key], path=path+'/'+key, compression=h5_compr_type, compression_opts=h5_compr_opts)
-            elif isinstance(value, allowed_elems[1]):
+            elif isinstance(value, dmarray):
                 try:
-                    hfile[path].create_dataset(key, data=value, compression=h5_compr_type, compression_opts=h5_compr_opts)
+                    grp.create_dataset(key, data=value, **dset_opts(value))
                 except:
-                    dumval = value.copy()
-                    if isinstance(value[0], datetime.datetime):
-                        for i, val in enumerate(value): dumval[i] = val.isoformat()
-                    hfile[path].create_dataset(key, data=dumval.astype('|S35'), compression=h5_compr_type, compression_opts=h5_compr_opts)
+                    if value.size and isinstance(value.flat[0], datetime.datetime):
+                        dumval = _isoformat_array(value)
+                    else:
+                        dumval = value
+                    grp.create_dataset(key, data=dumval.astype('|S35'), **dset_opts(value))
                     #else:
                     #    hfile[path].create_dataset(key, data=value.astype(float))
-                SDcarryattrs(SDobject[key], hfile, path+'/'+key, allowed_attrs)
+                SDcarryattrs(SDobject[key], hfile, path+'/'+key)
             else:
                 warnings.warn('The following data is not being written as is not of an allowed type\n' +
                                'key = {0} ({1})\n'.format(key, type(key)) +
@@ -1198,6 +1522,28 @@ def toHDF5(fname, SDobject, **kwargs):
             hfile.close()
 
 
+def _isoformat_array(value):
+    """
+    Convert an array of datetimes to an array of ISO 8601 strings
+
+    Output matches datetime.isoformat, i.e. microseconds are only included
+    if nonzero. The conversion is done in numpy where possible; timezone-aware
+    datetimes fall back to calling isoformat on each element.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning) # tz-aware
+            dt64 = numpy.asarray(value, dtype='datetime64[us]')
+    except (DeprecationWarning, TypeError, ValueError):
+        out = numpy.empty(numpy.shape(value), dtype=object)
+        for idx, val in numpy.ndenumerate(value):
+            out[idx] = val.isoformat()
+        return out
+    whole_sec = dt64.astype('datetime64[s]') == dt64
+    return numpy.where(whole_sec,
+                       numpy.datetime_as_string(dt64, unit='s'),
+                       numpy.datetime_as_string(dt64, unit='us'))
+
 def fromNC3(fname):
     try:
         from scipy.io import netcdf as nc
@@ -1337,20 +1683,31 @@ def readJSONMetadata(fname, **kwargs):
     -------
     mdata: spacepy.datamodel.SpaceData
         SpaceData with the metadata from the file
+
+    Notes
+    -----
+    The header is the block of lines starting with ``#`` at the top of the
+    file; reading stops at the first line that does not, so the data
+    are not read.
     '''
+    def readheader(f):
+        hreg = []
+        for line in f:
+            if not line.startswith('#'):
+                break
+            hreg.append(line[1:].rstrip('\n'))
+        return hreg
+
+    # isolate header
     if hasattr(fname, 'read'):
-        lines = fname.read()
+        hreg = readheader(fname)
     else:
         with open(fname, 'r') as f:
-            lines = f.read()
-
-    # isolate header
-    p_srch = re.compile(r"^#(.*)$", re.M)
-    hreg = re.findall(p_srch, lines)
+            hreg = readheader(f)
     header = "".join(hreg)
 
     # isolate JSON field
-    srch = re.search(r'\{\s*(.*)\s*\}', header )
+    srch = _JSON_BODY.search(header)
     if isinstance(srch, type(None)):
         raise IOError('The input file has no valid JSON header. Must be valid JSON bounded by braces "{ }".')
     js = srch.group(1)
@@ -1358,10 +1715,10 @@ def readJSONMetadata(fname, **kwargs):
 
     if inx == -1:
         js = ' '.join(('{', js, '}'))
-        mdatadict = json.loads(js)
+        mdatadict = _loads(js)
     else:
         js = ' '.join(('{', js[:inx]))
-        mdatadict = json.loads(js)
+        mdatadict = _loads(js)
 
     mdata = SpaceData()
     for key in mdatadict:
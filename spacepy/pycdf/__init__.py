@@ -3782,6 +3782,7 @@ class VarCopy(spacepy.datamodel.dmarray):
     """
     Allowed_Attributes = spacepy.datamodel.dmarray.Allowed_Attributes \
                          + ['_cdf_meta']
+    _allowed = frozenset(Allowed_Attributes)
 
     def __new__(cls, zVar):
         """Copies all data and attributes from a zVariable
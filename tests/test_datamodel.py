@@ -93,6 +93,25 @@ class SpaceDataTests(unittest.TestCase):
         self.assertEqual(sorted(b.keys()),
                          sorted(['1<--pig<--fish<--a', '4<--cat', '1<--dog', '1<--pig<--fish<--b', '5']))
 
+    def test_flatten_function_deepcopy(self):
+        """Flatten returns values by reference unless deepcopy is set"""
+        a = dm.SpaceData()
+        a['1'] = dm.SpaceData(dog=dm.dmarray([1, 2, 3], attrs={'a': 1}),
+                              cat=[4, 5])
+        b = dm.flatten(a)
+        self.assertTrue(b['1<--dog'] is a['1']['dog'])
+        self.assertTrue(b['1<--cat'] is a['1']['cat'])
+        b = dm.flatten(a, deepcopy=True)
+        self.assertFalse(b['1<--dog'] is a['1']['dog'])
+        self.assertFalse(b['1<--cat'] is a['1']['cat'])
+        b = dm.flatten(a, copy=True)
+        self.assertFalse(b['1<--cat'] is a['1']['cat'])
+        self.assertEqual(a['1']['cat'], b['1<--cat'])
+        self.assertFalse(b['1<--dog'] is a['1']['dog'])
+        np.testing.assert_array_equal(a['1']['dog'], b['1<--dog'])
+        np.testing.assert_array_equal(a['1']['dog'], b['1<--dog'])
+        self.assertEqual(a['1']['dog'].attrs, b['1<--dog'].attrs)
+
     def test_unflatten_function(self):
         """Unflatten should unflatten a flattened SpaceData"""
         a = dm.SpaceData()
@@ -181,6 +200,33 @@ class SpaceDataTests(unittest.TestCase):
         np.testing.assert_array_equal((3,2,2), sd[names[2]].shape)
         np.testing.assert_array_equal(np.zeros(3), sd[names[0]])
 
+    def test_toTable(self):
+        '''toTable should stack the most common length variables'''
+        a = dm.SpaceData()
+        a['x'] = dm.dmarray([1.0, 2.0, 3.0])
+        a['y'] = dm.dmarray([[1, 2], [3, 4], [5, 6]])
+        a['z'] = dm.dmarray([7, 8])
+        a['n'] = dm.SpaceData(w=dm.dmarray([1, 2, 3]))
+        a[5] = dm.dmarray([4, 5, 6])
+        tab = a.toTable()
+        self.assertEqual(['x', 'y', '5'], list(tab.dtype.names))
+        self.assertEqual((3,), tab.shape)
+        np.testing.assert_array_equal(a['y'], tab['y'])
+        sd = dm.fromRecArray(tab)
+        np.testing.assert_array_equal(a['x'], sd['x'])
+        np.testing.assert_array_equal(a['y'], sd['y'])
+        tab = a.toTable(length=2)
+        self.assertEqual(['z'], list(tab.dtype.names))
+        self.assertRaises(ValueError, a.toTable, length=4)
+        self.assertRaises(ValueError, dm.SpaceData().toTable)
+        a['5'] = dm.dmarray([7, 8, 9])
+        try:
+            a.toTable()
+        except ValueError as e:
+            self.assertTrue("5 and '5'" in str(e))
+        else:
+            self.fail('Duplicate field names should raise ValueError')
+
     def test_multiget(self):
         '''Allow for multiple keys to be specified'''
         a = dm.SpaceData()
@@ -399,6 +445,29 @@ class dmarrayTests(unittest.TestCase):
         data2 = dm.dmarray([1,2,3], dtype=float, attrs={'coord':'GSM'})
         np.testing.assert_almost_equal([1,2,3], data2)
 
+    def test_creation_dmarray_dtype(self):
+        """dmarray copies data if a dtype is given, even if the same"""
+        raw = np.array([1, 2, 3], dtype=np.int32)
+        self.assertTrue(np.shares_memory(raw, dm.dmarray(raw)))
+        data = dm.dmarray(raw, dtype=np.int32)
+        self.assertFalse(np.shares_memory(raw, data))
+        data = dm.dmarray(raw, dtype=np.float64, attrs={'coord':'GSM'})
+        self.assertFalse(np.shares_memory(raw, data))
+        self.assertEqual(np.float64, data.dtype)
+        self.assertEqual({'coord':'GSM'}, data.attrs)
+        np.testing.assert_array_equal([1., 2., 3.], data)
+
+    def test_empty_attrs_independent(self):
+        """Arrays derived from one with empty attrs get their own attrs"""
+        a = dm.dmarray([1, 2, 3])
+        b = a[1:]
+        c = np.arange(3).view(dm.dmarray)
+        b.attrs['foo'] = 'bar'
+        c.attrs['foo'] = 'baz'
+        self.assertEqual({}, a.attrs)
+        self.assertEqual({'foo': 'bar'}, b.attrs)
+        self.assertEqual({'foo': 'baz'}, c.attrs)
+
     def test_different_attrs(self):
         """Different instances of dmarray shouldn't share attrs"""
         a = dm.dmarray([1, 2, 3, 4])
@@ -437,6 +506,34 @@ class dmarrayTests(unittest.TestCase):
         np.testing.assert_almost_equal(self.dat, dat2)
         self.assertEqual(self.dat.attrs, dat2.attrs)
 
+    @unittest.skipIf(pickle.HIGHEST_PROTOCOL < 5, 'Requires pickle protocol 5')
+    def test_pickle_protocol5(self):
+        """things should pickle and unpickle with out-of-band buffers"""
+        buffers = []
+        tmp = pickle.dumps(self.dat, protocol=5,
+                           buffer_callback=buffers.append)
+        self.assertEqual(1, len(buffers))
+        dat2 = pickle.loads(tmp, buffers=buffers)
+        self.assertTrue(isinstance(dat2, dm.dmarray))
+        np.testing.assert_array_equal(self.dat, dat2)
+        self.assertEqual(self.dat.attrs, dat2.attrs)
+
+    def test_unpickle_old_state(self):
+        """State from the old (name, value) pickle format is restored"""
+        nd_state = np.ndarray.__reduce__(np.array([1, 2, 3]))[2]
+        dat = dm.dmarray([])
+        dat.__setstate__((nd_state, (('attrs', {'a': 'a'}),)))
+        np.testing.assert_array_equal([1, 2, 3], dat)
+        self.assertEqual({'a': 'a'}, dat.attrs)
+
+    def test_attrs_slot(self):
+        """attrs lives in a slot and survives a pickle round trip"""
+        self.assertEqual({}, self.dat.__dict__)
+        self.dat.addAttribute('foo', 'bar')
+        dat2 = pickle.loads(pickle.dumps(self.dat))
+        self.assertEqual(self.dat.attrs, dat2.attrs)
+        self.assertEqual('bar', dat2.foo)
+
     def test_attrs_only(self):
         """dmarray can only have .attrs"""
         self.assertRaises(TypeError, dm.dmarray, [1,2,3], setme = 123 )
@@ -476,6 +573,35 @@ class dmarrayTests(unittest.TestCase):
         self.assertEqual(a.bla2['foo'], 'bar')
         self.assertRaises(NameError, a.addAttribute, 'bla2')
 
+    def test_addAttribute_instance(self):
+        """addAttribute only affects that array and those derived from it"""
+        a = dm.dmarray([1,2,3])
+        a.addAttribute('bla', {'foo': 'bar'})
+        b = dm.dmarray([1,2,3])
+        self.assertFalse('bla' in b.Allowed_Attributes)
+        self.assertRaises(TypeError, setattr, b, 'bla', 1)
+        c = a[1:]
+        self.assertEqual(c.bla, {'foo': 'bar'})
+        self.assertFalse(c.bla is a.bla)
+
+    def test_view_subclass_attributes(self):
+        """Views keep the allowed attributes of the class viewed as"""
+        class Sub(dm.dmarray):
+            Allowed_Attributes = dm.dmarray.Allowed_Attributes + ['extra']
+            _allowed = frozenset(Allowed_Attributes)
+        sub = dm.dmarray([1., 2., 3.], attrs={'a': 1}).view(Sub)
+        self.assertEqual({}, sub.extra)
+        self.assertEqual({'a': 1}, sub.attrs)
+        sub.extra = {'b': 2}
+        plain = sub.view(dm.dmarray)
+        self.assertEqual(['attrs'], plain.Allowed_Attributes)
+        self.assertEqual({}, plain.__dict__)
+        self.assertRaises(TypeError, setattr, plain, 'extra', 1)
+        sub.addAttribute('more', 3)
+        plain = sub.view(dm.dmarray)
+        self.assertEqual(['attrs', 'extra', 'more'], plain.Allowed_Attributes)
+        self.assertEqual(3, plain.more)
+
     def test_attrs(self):
         """The only attribute the can be set is attrs"""
         self.assertRaises(TypeError, dm.dmarray, [1,2,3], bbb=23)
@@ -603,6 +729,22 @@ class converterTests(unittest.TestCase):
         b = dm.convertKeysToStr(a)
         self.assertEqual([str(list(a.keys())[0])], list(b.keys()))
 
+    def test_convertKeysToStr_nocopy(self):
+        """convertKeysToStr only makes new containers where needed"""
+        a = dm.SpaceData(attrs={'a': 1})
+        a['data'] = dm.SpaceData()
+        a['data']['test'] = dm.dmarray([1,2,3])
+        self.assertTrue(dm.convertKeysToStr(a) is a)
+        a['other'] = dm.SpaceData()
+        a['other'][50] = dm.dmarray([1,2,3])
+        b = dm.convertKeysToStr(a)
+        self.assertFalse(b is a)
+        self.assertEqual(a.attrs, b.attrs)
+        self.assertTrue(b['data'] is a['data'])
+        self.assertEqual(['50'], list(b['other'].keys()))
+        self.assertTrue(b['other']['50'] is a['other'][50])
+        self.assertEqual([50], list(a['other'].keys())) # input unchanged
+
     def test_toHDF5ListString(self):
         """Convert to HDF5, including a list of string in attributes"""
         a = dm.SpaceData()
@@ -665,6 +807,124 @@ class converterTests(unittest.TestCase):
         np.testing.assert_almost_equal(self.SDobj['var'], newobj['var'])
         self.assertEqual(self.SDobj['var'].attrs['a'], newobj['var'].attrs['a'])
 
+    def test_HDF5roundtripNested(self):
+        """Nested groups can go to hdf and back"""
+        a = dm.SpaceData(attrs={'global': 'test'})
+        a['grp'] = dm.SpaceData(attrs={'level': 1})
+        a['grp']['sub'] = dm.SpaceData(attrs={'level': 2})
+        a['grp']['sub']['var'] = dm.dmarray([1, 2, 3], attrs={'a': 'a'})
+        a['grp']['var'] = dm.dmarray([4.0, 5.0])
+        a['var'] = dm.dmarray(6)
+        dm.toHDF5(self.testfile, a)
+        newobj = dm.fromHDF5(self.testfile)
+        self.assertEqual('test', newobj.attrs['global'])
+        self.assertEqual(['grp', 'var'], sorted(newobj.keys()))
+        self.assertEqual(['sub', 'var'], sorted(newobj['grp'].keys()))
+        self.assertEqual(1, newobj['grp'].attrs['level'])
+        self.assertEqual(2, newobj['grp']['sub'].attrs['level'])
+        np.testing.assert_array_equal([1, 2, 3], newobj['grp']['sub']['var'])
+        self.assertEqual('a', newobj['grp']['sub']['var'].attrs['a'])
+        np.testing.assert_array_equal([4.0, 5.0], newobj['grp']['var'])
+        self.assertEqual(6, newobj['var'])
+        newobj = dm.fromHDF5(self.testfile, path='/grp')
+        self.assertEqual(1, newobj.attrs['level'])
+        self.assertEqual(['sub', 'var'], sorted(newobj.keys()))
+        np.testing.assert_array_equal([1, 2, 3], newobj['sub']['var'])
+
+    def test_HDF5links(self):
+        """Soft links and extra hard links are read like any other member"""
+        import h5py
+        with h5py.File(self.testfile, 'w') as f:
+            f['a'] = [1, 2, 3]
+            f['g/b'] = [4., 5.]
+            f['soft'] = h5py.SoftLink('/g/b')
+            f['hard'] = f['a']
+            f['gsoft'] = h5py.SoftLink('/g')
+        newobj = dm.fromHDF5(self.testfile)
+        self.assertEqual(['a', 'g', 'gsoft', 'hard', 'soft'],
+                         sorted(newobj.keys()))
+        np.testing.assert_array_equal([1, 2, 3], newobj['hard'])
+        np.testing.assert_array_equal([4., 5.], newobj['soft'])
+        np.testing.assert_array_equal([4., 5.], newobj['gsoft']['b'])
+        with h5py.File(self.testfile, 'a') as f:
+            f['g/up'] = h5py.SoftLink('/g')
+            f['g/h/top'] = f['/']
+        self.assertRaises(dm.DMWarning, dm.fromHDF5, self.testfile)
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always', dm.DMWarning)
+            newobj = dm.fromHDF5(self.testfile)
+        self.assertEqual(4, len(w)) # g and gsoft each have up and h/top
+        self.assertEqual(['b', 'h'], sorted(newobj['g'].keys()))
+        self.assertEqual({}, dict(newobj['gsoft']['h']))
+
+    def test_HDF5scalarString(self):
+        """Scalar variable-length strings are read as object arrays"""
+        import h5py
+        with h5py.File(self.testfile, 'w') as f:
+            f['s'] = 'abc'
+        newobj = dm.fromHDF5(self.testfile)
+        self.assertEqual(np.dtype(object), newobj['s'].dtype)
+        self.assertEqual((), newobj['s'].shape)
+        self.assertEqual(b'abc', newobj['s'][()])
+
+    def test_HDF5compressionDefault(self):
+        """Larger variables are compressed by default, small ones are not"""
+        import h5py
+        a = dm.SpaceData()
+        a['big'] = dm.dmarray(np.arange(2048.))
+        a['grp'] = dm.SpaceData(big=dm.dmarray(np.arange(2048.)))
+        a['small'] = dm.dmarray([1, 2, 3])
+        dm.toHDF5(self.testfile, a)
+        with h5py.File(self.testfile, 'r') as f:
+            for key in ('big', 'grp/big'):
+                self.assertEqual('gzip', f[key].compression)
+                self.assertEqual(4, f[key].compression_opts)
+                self.assertTrue(f[key].shuffle)
+            self.assertEqual(None, f['small'].compression)
+            self.assertEqual(None, f['small'].chunks)
+        newobj = dm.fromHDF5(self.testfile)
+        np.testing.assert_array_equal(a['big'], newobj['big'])
+        np.testing.assert_array_equal(a['grp']['big'], newobj['grp']['big'])
+        dm.toHDF5(self.testfile, a, compression=None)
+        with h5py.File(self.testfile, 'r') as f:
+            self.assertEqual(None, f['big'].compression)
+            self.assertEqual(None, f['grp/big'].compression)
+
+    def test_HDF5roundtripCache(self):
+        """Data can go to a paged hdf and back with a set chunk cache"""
+        try:
+            dm.toHDF5(self.testfile, self.SDobj, page_size=4096)
+        except TypeError: # older h5py
+            self.skipTest('h5py does not support paged aggregation')
+        newobj = dm.fromHDF5(self.testfile, rdcc_nbytes=1024**2,
+                             rdcc_nslots=521)
+        np.testing.assert_array_equal(self.SDobj['var'], newobj['var'])
+        self.assertEqual(self.SDobj['var'].attrs['a'], newobj['var'].attrs['a'])
+
+    def test_HDF5roundtripLazy(self):
+        """Data can be memory-mapped from hdf"""
+        self.SDobj['big'] = dm.dmarray(np.arange(2000, dtype='>i4'),
+                                       attrs={'b': 1})
+        self.SDobj['sub'] = dm.SpaceData(val=dm.dmarray([1.5, 2.5]))
+        dm.toHDF5(self.testfile, self.SDobj)
+        newobj = dm.fromHDF5(self.testfile, lazy=True)
+        def mapped(arr):
+            while arr is not None:
+                if isinstance(arr, np.memmap):
+                    return True
+                arr = getattr(arr, 'base', None)
+            return False
+        self.assertTrue(isinstance(newobj['sub']['val'], dm.dmarray))
+        self.assertTrue(mapped(newobj['sub']['val']))
+        self.assertFalse(mapped(newobj['big'])) # compressed
+        for key in ('var', 'big'):
+            np.testing.assert_array_equal(self.SDobj[key], newobj[key])
+            self.assertEqual(self.SDobj[key].attrs, newobj[key].attrs)
+        np.testing.assert_array_equal([1.5, 2.5], newobj['sub']['val'])
+        newobj['sub']['val'][0] = 99 # not written back
+        newobj = dm.fromHDF5(self.testfile)
+        np.testing.assert_array_equal([1.5, 2.5], newobj['sub']['val'])
+
     def test_HDF5Exceptions(self):
         """HDF5 has warnings and exceptions"""
         dm.toHDF5(self.testfile, self.SDobj)
@@ -695,6 +955,43 @@ class converterTests(unittest.TestCase):
         dm.toHDF5(self.testfile, a, compression='gzip')
         self.assertEqual(a['bar'], dm.dmarray([datetime.datetime(2000, 1, 1)]))
 
+    def test_HDF5attrSubclasses(self):
+        """Subclasses of the allowed attribute types are written"""
+        self.SDobj['var'].attrs['flag'] = np.bool_(True)
+        self.SDobj['var'].attrs['arr'] = dm.dmarray([1, 2])
+        self.SDobj['var'].attrs['zero'] = 0
+        self.SDobj['var'].attrs['empty'] = []
+        self.SDobj['var'].attrs['scalar'] = dm.dmarray(5)
+        dm.toHDF5(self.testfile, self.SDobj)
+        newobj = dm.fromHDF5(self.testfile)
+        self.assertTrue(newobj['var'].attrs['flag'])
+        np.testing.assert_array_equal([1, 2], newobj['var'].attrs['arr'])
+        self.assertEqual(0, newobj['var'].attrs['zero'])
+        self.assertEqual('', newobj['var'].attrs['empty'])
+        self.assertEqual(5, newobj['var'].attrs['scalar'])
+
+    def test_HDF5datetimes(self):
+        """Datetimes are written to hdf as ISO strings"""
+        a = dm.SpaceData()
+        a['t'] = dm.dmarray([datetime.datetime(2000, 1, 1),
+                             datetime.datetime(2000, 1, 1, 0, 0, 1, 500)])
+        dm.toHDF5(self.testfile, a)
+        newobj = dm.fromHDF5(self.testfile)
+        np.testing.assert_array_equal(
+            [b'2000-01-01T00:00:00', b'2000-01-01T00:00:01.000500'], newobj['t'])
+
+    def test_isoformat_array(self):
+        """_isoformat_array should match isoformat"""
+        dts = [datetime.datetime(2000, 1, 1),
+               datetime.datetime(2000, 1, 1, 0, 0, 1, 500),
+               datetime.datetime(2000, 1, 1, 0, 0, 1, 500,
+                                 tzinfo=datetime.timezone.utc)]
+        for val in (np.array(dts[:2]), np.array(dts[:2]).reshape(2, 1),
+                    np.array(dts)):
+            np.testing.assert_array_equal(
+                np.vectorize(lambda x: x.isoformat())(val),
+                dm._isoformat_array(val))
+
     def test_dateToISO(self):
         """dateToISO should recurse properly"""
         d1 = {'k1':datetime.datetime(2012,12,21)}
@@ -792,6 +1089,23 @@ class JSONTests(unittest.TestCase):
             del keys[ind]
         self.assertEqual(len(keys), 0)
 
+    def test_readJSONMetadata_headeronly(self):
+        """readJSONMetadata only reads the header at the top of the file"""
+        fh = StringIO.StringIO(
+            '#{"Var1": {"START_COLUMN": 0, "DIMENSION": [1]}}\n'
+            '1\n'
+            '#{"Var2": {"START_COLUMN": 1}}\n')
+        dat = dm.readJSONMetadata(fh)
+        self.assertEqual(['Var1'], list(dat.keys()))
+
+    def test_readJSONMetadata_nan(self):
+        """readJSONMetadata reads NaN, which is not strict JSON"""
+        fh = StringIO.StringIO(
+            '#{"Var1": {"START_COLUMN": 0, "FILLVAL": NaN}}\n'
+            '1\n')
+        dat = dm.readJSONMetadata(fh)
+        self.assertTrue(np.isnan(dat['Var1'].attrs['FILLVAL']))
+
     def test_readJSONMetadata_badfile(self):
         """readJSONMetadata fails on bad files"""
         self.assertRaises(ValueError, dm.readJSONMetadata, self.filename_bad)